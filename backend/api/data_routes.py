@@ -1,75 +1,225 @@
 import sqlite3
-import pandas as pd
-import json
-from datetime import datetime # needed for date parsing?
+import functools
+import threading
+import collections
+import os
+import orjson
 
-from flask import Blueprint, jsonify, request, current_app
-from init_db import get_db
-from services.anomaly_service import AnomalyService
+from flask import Blueprint, Response, request, current_app
+from init_db import get_read_db, FILTER_OPTION_COLUMNS
 
 data_bp = Blueprint('data_bp', __name__)
 
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+def ojsonify(data):
+    """Serializes data to a JSON response using orjson (much faster than jsonify on large payloads)."""
+    return Response(orjson.dumps(data, option=ORJSON_OPTIONS), mimetype='application/json')
+
+def database_version():
+    """Identifies the current database contents (path + modification times), used as a cache key."""
+    db_path = current_app.config['DATABASE']
+    # In WAL mode committed writes land in the -wal file first, so its mtime is part of the version
+    return db_path, _getmtime(db_path), _getmtime(db_path + '-wal')
+
+def _getmtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+def clear_response_caches():
+    """Drops cached responses. Called by init_db after the table is reloaded."""
+    _compute_filter_options.cache_clear()
+    with _data_cache_lock:
+        _data_cache.clear()
+
 @data_bp.route('/status', methods=['GET'])
 def status():
     """Returns the status of the API."""
-    return jsonify({'status': 'API is running'})
-
-def row_to_dict(row):
-    """Converts a sqlite3.Row object to a dictionary."""
-    return dict(row) if row else None
+    return ojsonify({'status': 'API is running'})
+
+# Explicit column list for border_crossing_entry_data (order matches schema.sql)
+DATA_COLUMNS = (
+    'id', 'port_name', 'state', 'port_code', 'border', 'date',
+    'measure', 'value', 'latitude', 'longitude', 'point'
+)
+
+# Filter query parameters shared by /data and /anomalies, in the fixed order used to build WHERE clauses
+FILTER_PARAMS = (
+    ('port_name', str),
+    ('state', str),
+    ('border', str),
+    ('measure', str),
+    ('date', str), # Exact match on the 'YYYY-MM-DD' string
+    ('port_code', int),
+)
+
+@functools.lru_cache(maxsize=None)
+def where_clause(active_filters):
+    """
+    Builds the WHERE clause for a tuple of active filter names using named parameters.
+    Filter order is fixed, so each filter combination always yields the same SQL text and
+    sqlite3 can reuse its prepared statement.
+    """
+    return ' WHERE 1=1' + ''.join(f' AND {name} = :{name}' for name in active_filters)
+
+def filter_params():
+    """Reads the filter query parameters. Returns (WHERE clause, dict of named params)."""
+    params = {}
+    for name, type_ in FILTER_PARAMS:
+        value = request.args.get(name, type=type_, default=None)
+        if value is not None and value != '':
+            params[name] = value
+    return where_clause(tuple(params)), params
+
+# Supported values of /data's 'sort' parameter -> ORDER BY clause (no sort when absent)
+DATA_SORT_ORDERS = {
+    'date_state_port': ' ORDER BY date DESC, state ASC, port_name ASC',
+}
+
+def stream_json_rows(cursor, columns, batch_size=1000):
+    """
+    Yields an executed cursor's rows as JSON array chunks, one batch at a time, so no list of row dicts is built.
+    Rows are plain tuples zipped with the given column names.
+    """
+    yield b'['
+    first = True
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        chunk = b','.join(orjson.dumps(dict(zip(columns, row)), option=ORJSON_OPTIONS) for row in rows)
+        yield chunk if first else b',' + chunk
+        first = False
+    yield b']'
+
+# Serialized /data responses, (db version, WHERE clause, param items, ORDER BY) -> bytes, least recently used first.
+# Bounded by total size rather than entry count: bodies above DATA_CACHE_MAX_ENTRY_BYTES (e.g. the unfiltered table)
+# are streamed on every request instead of being cached
+DATA_CACHE_MAX_BYTES = 256 * 1024 * 1024
+DATA_CACHE_MAX_ENTRY_BYTES = 16 * 1024 * 1024
+
+_data_cache = collections.OrderedDict()
+_data_cache_lock = threading.Lock()
+
+def _get_cached_data(key):
+    """Returns the cached body for key (marking it recently used) or None."""
+    with _data_cache_lock:
+        body = _data_cache.get(key)
+        if body is not None:
+            _data_cache.move_to_end(key)
+        return body
+
+def _cache_data(key, body):
+    """Stores a body, dropping entries of older database versions and then the least recently used ones to stay under DATA_CACHE_MAX_BYTES."""
+    with _data_cache_lock:
+        for old_key in [k for k in _data_cache if k[0] != key[0]]:
+            del _data_cache[old_key]
+        _data_cache[key] = body
+        total = sum(len(cached) for cached in _data_cache.values())
+        while total > DATA_CACHE_MAX_BYTES:
+            _, evicted = _data_cache.popitem(last=False)
+            total -= len(evicted)
+
+def _stream_and_cache(key, chunks):
+    """Passes the chunks through, caching the joined body once complete unless it grows past DATA_CACHE_MAX_ENTRY_BYTES."""
+    kept, size = [], 0
+    for chunk in chunks:
+        if kept is not None:
+            kept.append(chunk)
+            size += len(chunk)
+            if size > DATA_CACHE_MAX_ENTRY_BYTES:
+                kept = None # Too large to cache, keep streaming only
+        yield chunk
+    if kept is not None:
+        _cache_data(key, b''.join(kept))
 
 @data_bp.route('/data', methods=['GET'])
 def get_data():
     """
     Fetches border crossing entry data based on query parameters.
-    Supports filtering by: port_name, state, border, measure, date (exact match 'Mmm-YY'),
-                           port_code, value_min, value_max.
+    Supports filtering by (see FILTER_PARAMS): port_name, state, border, measure,
+                           date (exact match 'YYYY-MM-DD'), port_code.
+    Rows are unordered unless 'sort' is given ('date_state_port': date DESC, state, port_name).
     """
-    db = get_db()
-    cursor = db.cursor()
+    sort = request.args.get('sort')
+    if sort is not None and sort not in DATA_SORT_ORDERS:
+        return ojsonify({"error": f"Invalid 'sort'. Must be one of: {', '.join(DATA_SORT_ORDERS)}."}), 400
 
-    port_name = request.args.get('port_name')
-    state = request.args.get('state')
-    border = request.args.get('border')
-    measure = request.args.get('measure')
-    date = request.args.get('date')
-    port_code = request.args.get('port_code', type=int, default=None)
+    where, params = filter_params()
 
-    query = 'SELECT * FROM border_crossing_entry_data WHERE 1=1'
-    params = []
+    order_by = DATA_SORT_ORDERS.get(sort, '')
 
-    if port_name: query += ' AND port_name = ?'; params.append(port_name)
-    if state: query += ' AND state = ?'; params.append(state)
-    if border: query += ' AND border = ?'; params.append(border)
-    if measure: query += ' AND measure = ?'; params.append(measure)
-    if date: query += ' AND date = ?'; params.append(date) # Exact match for 'Mmm-YY'
-    if port_code is not None: query += ' AND port_code = ?'; params.append(port_code)
+    try:
+        # Identical filter sets are served from the cache
+        key = (database_version(), where, tuple(params.items()), order_by)
+        cached = _get_cached_data(key)
+        if cached is not None:
+            return Response(cached, mimetype='application/json')
 
-    query += ' ORDER BY date DESC, state ASC, port_name ASC'
+        cursor = get_read_db().cursor()
+        cursor.row_factory = None # Plain tuples, no sqlite3.Row wrapper per record
 
-    try:
+        query = f"SELECT {', '.join(DATA_COLUMNS)} FROM border_crossing_entry_data{where}{order_by}"
         cursor.execute(query, params)
-        rows = cursor.fetchall()
-        data = [row_to_dict(row) for row in rows]
-        return jsonify(data)
+
+        # Rows are streamed as they are serialized, the body is only kept if it is small enough to cache
+        return Response(_stream_and_cache(key, stream_json_rows(cursor, DATA_COLUMNS)), mimetype='application/json')
     
     except sqlite3.Error as e:
         current_app.logger.error(f"Database error in /data: {str(e)}")
-        return jsonify({"error": f"Database error: {str(e)}"}), 500
+        return ojsonify({"error": f"Database error: {str(e)}"}), 500
     
     except Exception as e:
         current_app.logger.error(f"Unexpected error in /data: {str(e)}")
-        return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
+        return ojsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
+
+def statistical_anomalies(cursor, where, params, threshold):
+    """
+    Runs 'statistical' (Z-score) detection inside SQLite for the rows matching the WHERE clause
+    (named parameters, see filter_params).
+    Mean and sample std dev (ddof=1) are computed with two aggregate passes, then only rows whose
+    |Z-score| exceeds the threshold are selected. Returns records shaped like the AnomalyService output.
+    """
+    table = 'border_crossing_entry_data'
+
+    cursor.execute(f"SELECT COUNT(value), AVG(value) FROM {table}{where}", params)
+    count, mean = cursor.fetchone()
+    if count < 2:
+        # 2 points needed for std dev, if cannot calc => mark nothing as anomaly
+        return []
+
+    cursor.execute(f"SELECT SUM((value - :mean) * (value - :mean)) FROM {table}{where}", {**params, 'mean': mean})
+    std_dev = (cursor.fetchone()[0] / (count - 1)) ** 0.5
+    if std_dev == 0:
+        # If std dev 0, all valid values are same, no stat anomalies.
+        return []
+
+    cursor.execute(
+        f"SELECT {', '.join(DATA_COLUMNS)}, (value - :mean) / :std_dev AS z_score FROM {table}{where}"
+        f" AND ABS((value - :mean) / :std_dev) > :threshold",
+        {**params, 'mean': mean, 'std_dev': std_dev, 'threshold': threshold}
+    )
+    anomalies = []
+    for row in cursor.fetchall():
+        record = dict(zip(DATA_COLUMNS, row))
+        record['is_anomaly'] = True
+        record['anomaly_reason'] = f"Statistical: Z-score {row[-1]:.2f} exceeds threshold {threshold}"
+        anomalies.append(record)
+    return anomalies
 
 @data_bp.route('/anomalies', methods=['GET'])
 def get_anomalies():
     """
     Fetches data based on filters and identifies anomalies based on selected type.
-    Requires 'anomaly_type' parameter ('statistical' or 'out_of_range').
-    Uses 'threshold' for 'statistical' & 'time_series_stl', 'value_min'/'value_max' for 'out_of_range'.
+    Requires 'anomaly_type' parameter ('statistical', 'out_of_range', 'time_series_stl' or 'hampel').
+    Uses 'threshold' for 'statistical', 'time_series_stl' & 'hampel', 'value_min'/'value_max' for 'out_of_range',
+    'hampel_window' for 'hampel'.
     """
-    db = get_db()
+    db = get_read_db()
     cursor = db.cursor()
+    cursor.row_factory = None # Plain tuples, no sqlite3.Row wrapper per record
 
     anomaly_type = request.args.get('anomaly_type', default='statistical') # Default if not provided
     threshold = request.args.get('threshold', type=float, default=3.0)
@@ -78,46 +228,45 @@ def get_anomalies():
     max_value_param = request.args.get('value_max', type=float, default=None)
 
     seasonal_period = request.args.get('seasonal_period', type=int, default=12)
+    hampel_window = request.args.get('hampel_window', type=int, default=3)
 
-    allowed_types = ['statistical', 'out_of_range', 'time_series_stl']
+    allowed_types = ['statistical', 'out_of_range', 'time_series_stl', 'hampel']
 
     if anomaly_type not in allowed_types:
-         return jsonify({"error": f"Invalid 'anomaly_type'. Must be one of: {', '.join(allowed_types)}."}), 400
+         return ojsonify({"error": f"Invalid 'anomaly_type'. Must be one of: {', '.join(allowed_types)}."}), 400
     
     if anomaly_type == 'out_of_range' and min_value_param is None and max_value_param is None:
-         return jsonify({"error": "'out_of_range' requires at least 'value_min' or 'value_max' parameter."}), 400
+         return ojsonify({"error": "'out_of_range' requires at least 'value_min' or 'value_max' parameter."}), 400
 
-    port_name = request.args.get('port_name')
-    state = request.args.get('state')
-    border = request.args.get('border')
-    measure = request.args.get('measure')
-    date = request.args.get('date')
-    port_code = request.args.get('port_code', type=int, default=None)
+    if anomaly_type == 'hampel' and hampel_window < 1:
+         return ojsonify({"error": "'hampel_window' must be at least 1."}), 400
 
-    query = 'SELECT * FROM border_crossing_entry_data WHERE 1=1'
-    params = []
+    where, params = filter_params()
+    where += ' AND value IS NOT NULL' # Need this to ensure validity for anomaly service
 
-    if port_name: query += ' AND port_name = ?'; params.append(port_name)
-    if state: query += ' AND state = ?'; params.append(state)
-    if border: query += ' AND border = ?'; params.append(border)
-    if measure: query += ' AND measure = ?'; params.append(measure)
-    if date: query += ' AND date = ?'; params.append(date)
-    if port_code is not None: query += ' AND port_code = ?'; params.append(port_code)
-    query += ' AND value IS NOT NULL' # Need this to ensure validity for anomaly service
-
-    # Order chronologically for STL
-    query += ' ORDER BY date ASC'
+    # No ORDER BY: detection methods that need chronological order (STL, Hampel) sort by date themselves
+    query = f"SELECT {', '.join(DATA_COLUMNS)} FROM border_crossing_entry_data{where}"
 
     try:
+        if anomaly_type == 'statistical':
+            # Z-scores are computed in SQL, so only the anomalous rows leave the database
+            return ojsonify(statistical_anomalies(cursor, where, params, threshold))
+
+        # pandas and the anomaly service (numpy/numba) are imported on first use so that workers
+        # serving only /status, /data and /filter-options never load them
+        import pandas as pd
+        from services.anomaly_service import AnomalyService
+
         cursor.execute(query, params)
         rows = cursor.fetchall()
         if not rows:
-            return jsonify([])
+            return ojsonify([])
 
-        df = pd.DataFrame([row_to_dict(row) for row in rows])
+        # Build columns straight from the row tuples, no per-row dicts
+        df = pd.DataFrame.from_records(rows, columns=[d[0] for d in cursor.description])
 
         if df.empty or 'value' not in df.columns or df['value'].isnull().all():
-            return jsonify([])
+            return ojsonify([])
 
         # Call to AnomalyService
         df_result = AnomalyService.detect_anomalies(
@@ -127,77 +276,75 @@ def get_anomalies():
             threshold=threshold,
             min_value=min_value_param,
             max_value=max_value_param,
-            seasonal_period=seasonal_period
+            seasonal_period=seasonal_period,
+            hampel_window=hampel_window
         )
 
         anomalies_df = df_result[df_result['is_anomaly'] == True]
-        anomalies_list_compatible = json.loads(anomalies_df.to_json(orient='records', date_format='iso'))
 
-        return jsonify(anomalies_list_compatible)
+        # Single serialization pass: records go straight to orjson (dates are already ISO strings)
+        return ojsonify(anomalies_df.to_dict(orient='records'))
 
     except sqlite3.Error as e:
         current_app.logger.error(f"Database error fetching data for /anomalies: {str(e)}")
-        return jsonify({"error": f"Database error: {str(e)}"}), 500
+        return ojsonify({"error": f"Database error: {str(e)}"}), 500
     
     except KeyError as e:
          current_app.logger.error(f"Missing column for anomaly detection (expected 'value'): {str(e)}")
-         return jsonify({"error": f"Data processing error: Missing 'value' column."}), 500
+         return ojsonify({"error": f"Data processing error: Missing 'value' column."}), 500
     
     except Exception as e:
         current_app.logger.error(f"Error during anomaly detection in /anomalies: {str(e)}")
-        return jsonify({"error": f"An error occurred during anomaly detection: {str(e)}"}), 500
+        return ojsonify({"error": f"An error occurred during anomaly detection: {str(e)}"}), 500
 
-@data_bp.route('/filter-options', methods=['GET'])
-def get_filter_options():
-    """Fetches distinct values for available filters."""
-    db = get_db()
+@functools.lru_cache(maxsize=1)
+def _compute_filter_options(db_version):
+    """
+    Reads the filter_options table materialized by init-db and returns the serialized options.
+    The table is static after init-db, so the bytes are cached per database version.
+    """
+    db = get_read_db()
     cursor = db.cursor()
-    options = {}
-    table = 'border_crossing_entry_data'
+    options = {kind: [] for kind, _ in FILTER_OPTION_COLUMNS}
+
+    # Port Names (TODO: Add Search Feature), States, Borders, Measures, Dates, Port Codes
     try:
-        # Port Names (TODO: Add Search Feature)
-        cursor.execute(f"SELECT DISTINCT port_name FROM {table} ORDER BY port_name")
-        ports = cursor.fetchall()
-        options['port_names'] = [{'value': row['port_name'], 'label': row['port_name']} for row in ports]
-
-        # States
-        cursor.execute(f"SELECT DISTINCT state FROM {table} ORDER BY state")
-        states = cursor.fetchall()
-        options['states'] = [{'value': row['state'], 'label': row['state']} for row in states]
-
-        # Borders
-        cursor.execute(f"SELECT DISTINCT border FROM {table} ORDER BY border")
-        borders = cursor.fetchall()
-        options['borders'] = [{'value': row['border'], 'label': row['border']} for row in borders]
-
-        # Measures
-        cursor.execute(f"SELECT DISTINCT measure FROM {table} ORDER BY measure")
-        measures = cursor.fetchall()
-        options['measures'] = [{'value': row['measure'], 'label': row['measure']} for row in measures]
-
-        # Dates (ISO makes chronological)
-        cursor.execute(f"SELECT DISTINCT date FROM {table} ORDER BY date ASC")
-        dates = cursor.fetchall()
-        options['dates'] = [{'value': row['date'], 'label': row['date']} for row in dates]
-
-        # Port Codes (probably not needed ahah)
-        cursor.execute(f"SELECT DISTINCT port_code FROM {table} ORDER BY port_code")
-        codes = cursor.fetchall()
-        options['port_codes'] = [{'value': row['port_code'], 'label': str(row['port_code'])} for row in codes]
-
-        # Anomaly Types
-        options['anomaly_types'] = [
-            {'value': 'statistical', 'label': 'Statistical (Z-Score)'},
-            {'value': 'out_of_range', 'label': 'Out of Range (Min/Max)'},
-            {'value': 'time_series_stl', 'label': 'Time Series (STL)'}
+        cursor.execute("SELECT kind, value FROM filter_options ORDER BY id")
+        rows = cursor.fetchall()
+    except sqlite3.OperationalError as e:
+        if 'no such table' not in str(e):
+            raise
+        # Database built before filter_options existed (init-db not re-run): read the distinct values directly
+        current_app.logger.warning("filter_options table missing, re-run 'flask init-db' to materialize it")
+        rows = [
+            (kind, value)
+            for kind, column in FILTER_OPTION_COLUMNS
+            for (value,) in cursor.execute(f"SELECT DISTINCT {column} FROM border_crossing_entry_data ORDER BY {column}").fetchall()
         ]
 
-        return jsonify(options)
+    for kind, value in rows:
+        options[kind].append({'value': value, 'label': str(value)})
+
+    # Anomaly Types
+    options['anomaly_types'] = [
+        {'value': 'statistical', 'label': 'Statistical (Z-Score)'},
+        {'value': 'out_of_range', 'label': 'Out of Range (Min/Max)'},
+        {'value': 'time_series_stl', 'label': 'Time Series (STL)'},
+        {'value': 'hampel', 'label': 'Rolling Median (Hampel)'}
+    ]
+
+    return orjson.dumps(options, option=ORJSON_OPTIONS)
+
+@data_bp.route('/filter-options', methods=['GET'])
+def get_filter_options():
+    """Fetches distinct values for available filters (served from cache after the first call)."""
+    try:
+        return Response(_compute_filter_options(database_version()), mimetype='application/json')
     
     except sqlite3.Error as e:
         current_app.logger.error(f"Database error fetching filter options: {str(e)}")
-        return jsonify({"error": f"Database error fetching options: {str(e)}"}), 500
+        return ojsonify({"error": f"Database error fetching options: {str(e)}"}), 500
     
     except Exception as e:
         current_app.logger.error(f"Unexpected error fetching filter options: {str(e)}")
-        return jsonify({"error": f"An unexpected error occurred fetching options: {str(e)}"}), 500
+        return ojsonify({"error": f"An unexpected error occurred fetching options: {str(e)}"}), 500
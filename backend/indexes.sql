@@ -0,0 +1,12 @@
+-- Created by init-db after the bulk load (building them once is faster than maintaining them per inserted row)
+
+-- Indices for faster querying on frequently filtered columns
+CREATE INDEX IF NOT EXISTS idx_port_name ON border_crossing_entry_data (port_name);
+CREATE INDEX IF NOT EXISTS idx_state ON border_crossing_entry_data (state);
+CREATE INDEX IF NOT EXISTS idx_port_code ON border_crossing_entry_data (port_code);
+CREATE INDEX IF NOT EXISTS idx_border ON border_crossing_entry_data (border);
+CREATE INDEX IF NOT EXISTS idx_iso_date ON border_crossing_entry_data (date); -- Index on the standardized date string
+CREATE INDEX IF NOT EXISTS idx_measure ON border_crossing_entry_data (measure);
+
+-- Composite index for the common state/port filters, already ordered by date
+CREATE INDEX IF NOT EXISTS idx_state_port_date ON border_crossing_entry_data (state, port_name, date DESC);
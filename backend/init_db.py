@@ -1,7 +1,8 @@
 import sqlite3
+import threading
 import click
-import pandas as pd
 import os
+from urllib.request import pathname2url
 from flask import current_app, g
 from flask.cli import with_appcontext
 
@@ -13,16 +14,67 @@ def get_db():
             detect_types=sqlite3.PARSE_DECLTYPES
         )
         g.db.row_factory = sqlite3.Row
+        # WAL lets concurrent readers proceed while another connection writes
+        g.db.execute('PRAGMA journal_mode=WAL')
+        g.db.execute('PRAGMA synchronous=NORMAL')
     return g.db
 
+# Shared read-only connections, one per database path, reused across requests and threads
+_read_connections = {}
+_read_connections_lock = threading.Lock()
+
+def get_read_db():
+    """
+    Returns a process-wide read-only connection to the configed db (opened on first use).
+    Safe to share across request threads: it only runs SELECTs and sqlite3 is built in serialized mode.
+    Writes (init-db) go through get_db().
+    """
+    db_path = current_app.config['DATABASE']
+    with _read_connections_lock:
+        db = _read_connections.get(db_path)
+        if db is None:
+            db = sqlite3.connect(
+                f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro",
+                uri=True,
+                check_same_thread=False,
+                detect_types=sqlite3.PARSE_DECLTYPES
+            )
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA query_only=1')
+            db.execute('PRAGMA mmap_size=268435456') # Map up to 256MB of the db file instead of copying pages
+            _read_connections[db_path] = db
+    return db
+
 def close_db(e=None):
     """Closes db connection."""
     db = g.pop('db', None)
     if db is not None:
         db.close()
 
+# Response key in /filter-options -> source column, in response order
+FILTER_OPTION_COLUMNS = [
+    ('port_names', 'port_name'),
+    ('states', 'state'),
+    ('borders', 'border'),
+    ('measures', 'measure'),
+    ('dates', 'date'), # ISO makes chronological
+    ('port_codes', 'port_code'),
+]
+
+def build_filter_options(db):
+    """Materializes the distinct value of each filter column into the filter_options table."""
+    db.execute('DELETE FROM filter_options')
+    for kind, column in FILTER_OPTION_COLUMNS:
+        db.execute(
+            f"INSERT INTO filter_options (kind, value) "
+            f"SELECT DISTINCT ?, {column} FROM border_crossing_entry_data ORDER BY {column}",
+            (kind,)
+        )
+
 def init_db():
     """Clears existing data, creates new table based on schema.sql, and loads data from CSV."""
+    import pandas as pd # Only needed for loading; keeps pandas off the API server's startup path
+
     db = get_db()
 
     click.echo("Creating database tables from schema.sql...")
@@ -110,19 +162,52 @@ def init_db():
         else:
              click.echo("Warning: 'date' column not found for format conversion.")
 
-        df_to_insert = df_to_insert.where(pd.notnull(df_to_insert), None)
-
+        # Missing values (NaN/NA) become None per column when the insert arrays are built below,
+        # so no full-frame notnull mask or object-dtype copy is needed here
         click.echo("Cleaned numeric data and handled missing values.")
         click.echo("Inserting data into the database (this may take a moment)...")
 
         table_name = 'border_crossing_entry_data'
+        insert_sql = (
+            f"INSERT INTO {table_name} ({', '.join(required_columns)}) "
+            f"VALUES ({', '.join('?' * len(required_columns))})"
+        )
+
+        # Column-wise object arrays hold plain Python scalars (None for missing), which sqlite3 binds directly
+        column_values = [df_to_insert[col].to_numpy(dtype=object, na_value=None) for col in required_columns]
 
-        df_to_insert.to_sql(table_name, db, if_exists='append', index=False)
+        # Bulk-load settings: no fsyncs, temp b-trees in RAM. The journal stays in WAL mode: switching it
+        # needs exclusive access, which the API's shared read connection (get_read_db) would block
+        db.execute('PRAGMA synchronous=OFF')
+        db.execute('PRAGMA temp_store=MEMORY')
+
+        db.executemany(insert_sql, zip(*column_values))
+
+        # Indices are built once over the loaded rows rather than maintained per insert.
+        # Statements run one by one (not executescript, which would commit) so the load stays one transaction
+        click.echo("Building indices from indexes.sql...")
+        with current_app.open_resource('indexes.sql') as f:
+            for statement in f.read().decode('utf8').split(';'):
+                db.execute(statement)
+
+        click.echo("Building filter options table...")
+        build_filter_options(db)
 
         # Commit transaction
         db.commit() 
         click.echo(f"Successfully inserted {len(df_to_insert)} rows into '{table_name}'.")
 
+        # Restore the regular connection settings (see get_db)
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute('PRAGMA temp_store=DEFAULT')
+
+        # Refresh planner statistics so the filter indices are picked up
+        db.execute('ANALYZE')
+
+        # Cached API responses describe the old data
+        from api.data_routes import clear_response_caches
+        clear_response_caches()
+
     except pd.errors.EmptyDataError:
         click.echo(f"Error: The CSV file '{csv_filename}' is empty.")
 
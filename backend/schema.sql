@@ -1,5 +1,6 @@
--- Drop table if it exists
+-- Drop tables if they exist
 DROP TABLE IF EXISTS border_crossing_entry_data;
+DROP TABLE IF EXISTS filter_options;
 
 -- Creation
 CREATE TABLE border_crossing_entry_data (
@@ -16,10 +17,9 @@ CREATE TABLE border_crossing_entry_data (
     point TEXT 
 );
 
--- Indices for faster querying on frequently filtered columns
-CREATE INDEX IF NOT EXISTS idx_port_name ON border_crossing_entry_data (port_name);
-CREATE INDEX IF NOT EXISTS idx_state ON border_crossing_entry_data (state);
-CREATE INDEX IF NOT EXISTS idx_port_code ON border_crossing_entry_data (port_code);
-CREATE INDEX IF NOT EXISTS idx_border ON border_crossing_entry_data (border);
-CREATE INDEX IF NOT EXISTS idx_iso_date ON border_crossing_entry_data (date); -- Index on the standardized date string
-CREATE INDEX IF NOT EXISTS idx_measure ON border_crossing_entry_data (measure);
+-- Distinct filter values, materialized by init-db after loading (rows kept in display order)
+CREATE TABLE filter_options (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL, -- Key in the /filter-options response, e.g. 'port_names'
+    value -- No type affinity so port codes stay integers
+);
@@ -1,180 +1,289 @@
 import pandas as pd
 import numpy as np
-from statsmodels.tsa.seasonal import STL
 import warnings
+from numba import njit
+
+@njit(cache=True)
+def _zscore_mask(vals, threshold):
+    """
+    Computes Z-scores and the |z| > threshold mask for a float64 array, skipping NaNs.
+    Mean and sample std (ddof=1) come from a single Welford pass; Z-scores stay NaN (mask False)
+    when fewer than 2 valid values exist or the std is 0.
+    """
+    n = 0
+    mean = 0.0
+    m2 = 0.0
+    for x in vals:
+        if not np.isnan(x):
+            n += 1
+            delta = x - mean
+            mean += delta / n
+            m2 += delta * (x - mean)
+
+    z_scores = np.full(vals.shape[0], np.nan)
+    mask = np.zeros(vals.shape[0], dtype=np.bool_)
+    if n < 2:
+        return z_scores, mask
+
+    std_dev = np.sqrt(m2 / (n - 1))
+    if std_dev == 0:
+        return z_scores, mask
+
+    for i in range(vals.shape[0]):
+        x = vals[i]
+        if not np.isnan(x):
+            z = (x - mean) / std_dev
+            z_scores[i] = z
+            mask[i] = abs(z) > threshold
+    return z_scores, mask
+
+@njit(cache=True)
+def _hampel_mask(vals, window, n_sigmas):
+    """
+    Hampel filter: flags x[t] when |x[t] - median| > n_sigmas * MAD over the window
+    [t - window, t + window], with MAD = 1.4826 * median(|x - median|). NaNs are ignored.
+    Windows with a MAD of 0 (mostly constant values) flag nothing, since any deviation would exceed every threshold.
+    Returns the mask and the rolling medians.
+    """
+    n = vals.shape[0]
+    mask = np.zeros(n, dtype=np.bool_)
+    medians = np.full(n, np.nan)
+    for t in range(n):
+        x = vals[t]
+        if np.isnan(x):
+            continue
+        neighbours = vals[max(0, t - window):min(n, t + window + 1)]
+        neighbours = neighbours[~np.isnan(neighbours)]
+        median = np.median(neighbours)
+        mad = 1.4826 * np.median(np.abs(neighbours - median))
+        medians[t] = median
+        mask[t] = mad > 0 and abs(x - median) > n_sigmas * mad
+    return mask, medians
+
+# Columns identifying one time series (a port's counts for one measure); 'hampel' windows never cross series
+HAMPEL_SERIES_COLUMNS = ('port_code', 'measure')
 
 class AnomalyService:
     @staticmethod
-    def detect_anomalies(df, value_col='value', anomaly_type='statistical', threshold=3.0, min_value=None, max_value=None, seasonal_period=12):
+    def detect_anomalies(df, value_col='value', anomaly_type='statistical', threshold=3.0, min_value=None, max_value=None, seasonal_period=12, hampel_window=3):
         """
         Detects anomalies in a DataFrame based on specified method.
 
         Args:
-            df (pd.DataFrame): Input DataFrame containing data
+            df (pd.DataFrame): Input DataFrame containing data. Its 'date' column (used by 'time_series_stl'
+                               and 'hampel') may hold 'YYYY-MM-DD' strings or datetime64 values
             value_col (str): Name of the colunm containing the values to analyze
             anomaly_type (str): Type of anomaly detection
-            threshold (float): The Z-score threshold for 'statistical' detection
+            threshold (float): The Z-score threshold for 'statistical' detection (number of scaled MADs for 'hampel')
             min_value (float, optional): The minimum allowed value for 'out_of_range'
             max_value (float, optional): The maximum allowed value for 'out_of_range'
             seasonal_period (int): The seasonal period for STL (default 12 for monthly data)
+            hampel_window (int): Points on each side of the rolling window for 'hampel'
 
         Returns:
             pd.DataFrame: The original DataFrame with two added columns:
                           'is_anomaly' (bool) and 'anomaly_reason' (str).
         """
         if df.empty or value_col not in df.columns:
-            df['is_anomaly'] = False
-            df['anomaly_reason'] = ''
-            return df
-
-        # Ensure value column is numeric, coerce errors, handle potential all-NaN column
-        df[value_col] = pd.to_numeric(df[value_col], errors='coerce')
-
-        if df[value_col].isnull().all():
-            df['is_anomaly'] = False
-            df['anomaly_reason'] = ''
-            return df
-
-        df_result = df.copy()
-        df_result['is_anomaly'] = False
-        df_result['anomaly_reason'] = ''
-
-        df_analysis = df.dropna(subset=[value_col]).copy()
-
-        if df_analysis.empty:
+            result = df.copy(deep=False)
+            result['is_anomaly'] = False
+            result['anomaly_reason'] = ''
+            return result
+
+        # Values are normally numeric already (normalized in init_db); only coerce when they are not
+        values = df[value_col]
+        coerced = not pd.api.types.is_numeric_dtype(values)
+        if coerced:
+            values = pd.to_numeric(values, errors='coerce')
+
+        # Result columns are filled as plain arrays and attached once at the end
+        is_anomaly = np.zeros(len(df), dtype=bool)
+        anomaly_reason = np.full(len(df), '', dtype=object)
+
+        if values.isnull().all():
             # No valid data to analyze
-            return df_result
-
-        if anomaly_type == 'statistical':
-            valid_values = df_result[value_col].dropna()
-            if len(valid_values) < 2: 
-                 # 2 points needed for std dev, if cannot calc => mark nothing as anomaly
-                 return df_result
+            pass
 
-            mean = valid_values.mean()
-            std_dev = valid_values.std()
-
-            # Avoid division by zero if standard deviation is 0
-            if std_dev is None or pd.isna(std_dev) or std_dev == 0:
-                # If std dev 0, all valid values are same, no stat anomalies.
-                 return df_result
-
-            # Calc Z-score only for non-null values
-            z_scores = df_result[value_col].apply(lambda x: (x - mean) / std_dev if pd.notna(x) else np.nan)
-
-            # Identify anomalies based on threshold
-            anomaly_mask = z_scores.abs() > threshold
-            df_result.loc[anomaly_mask, 'is_anomaly'] = True
-
-            # Apply reason only where anomaly_mask True, z_score not NaN
-            df_result.loc[anomaly_mask & z_scores.notna(), 'anomaly_reason'] = z_scores[anomaly_mask & z_scores.notna()].apply(
-                lambda z: f"Statistical: Z-score {z:.2f} exceeds threshold {threshold}"
-            )
+        elif anomaly_type == 'statistical':
+            AnomalyService._flag_statistical(values, threshold, is_anomaly, anomaly_reason)
 
         elif anomaly_type == 'out_of_range':
-            if min_value is None and max_value is None:
-                # No range defined, cannot detect this type of anomaly
-                 print("Warning: Out of Range detection selected but no min or max provided.")
-                 return df_result
-
-            below_min_mask = pd.Series([False] * len(df_result))
-            above_max_mask = pd.Series([False] * len(df_result))
-
-            if min_value is not None:
-                 below_min_mask = (df_result[value_col].notna()) & (df_result[value_col] < min_value)
-                 df_result.loc[below_min_mask, 'is_anomaly'] = True
-                 df_result.loc[below_min_mask, 'anomaly_reason'] = df_result.loc[below_min_mask, value_col].apply(
-                     lambda v: f"Out of Range: Value {v} is below minimum {min_value}"
-                 )
-
-
-            if max_value is not None:
-                 above_max_mask = (df_result[value_col].notna()) & (df_result[value_col] > max_value)
-                 df_result.loc[above_max_mask, 'is_anomaly'] = True
-                 # Add/Update reason for values above max (potential overlap with below_min if min > max)
-                 # If already marked below min, append reason; otherwise set reason
-                 df_result.loc[above_max_mask, 'anomaly_reason'] = df_result.loc[above_max_mask].apply(
-                    lambda row: (row['anomaly_reason'] + "; " if row['anomaly_reason'] else "") + \
-                                f"Out of Range: Value {row[value_col]} is above maximum {max_value}", axis=1
-                 )
+            AnomalyService._flag_out_of_range(values, min_value, max_value, is_anomaly, anomaly_reason)
 
         elif anomaly_type == 'time_series_stl':
-            if 'date' not in df_analysis.columns:
-                print("Warning: 'date' column required for time_series_stl not found.")
-                return df_result
-
-            df_ts = df_analysis.reset_index().copy()
-
-            original_index_col_name = 'original_index'
-            if 'index' in df_ts.columns:
-                df_ts.rename(columns={'index': original_index_col_name}, inplace=True)
-            else:
-                 df_ts[original_index_col_name] = df_analysis.index
-
-            try:
-                df_ts['datetime'] = pd.to_datetime(df_ts['date'], format='%Y-%m-%d', errors='coerce')
-                df_ts.dropna(subset=['datetime'], inplace=True)
-
-                if df_ts.empty:
-                     print("Warning: No valid dates found for STL.")
-                     return df_result
-                
-                # 'datetime' set as working index for STL
-                df_ts = df_ts.set_index('datetime').sort_index()
-            except Exception as e:
-                print(f"Warning: Could not process 'date' column for STL: {e}")
-                return df_result
-
-            if len(df_ts) < 2 * seasonal_period:
-                print(f"Warning: Insufficient data ({len(df_ts)} points) for STL. Need {2 * seasonal_period}.")
-                return df_result
-
-            # STL Decomposition
-            try:
-                seasonal_smoother_len = max(7, seasonal_period + 1 if seasonal_period % 2 == 0 else seasonal_period)
-                with warnings.catch_warnings():
-                    warnings.simplefilter("ignore")
-                    stl = STL(endog=df_ts[value_col], period=seasonal_period, seasonal=seasonal_smoother_len, robust=True)
-                    result = stl.fit()
-
-                residuals = result.resid # Indexed by datetime
-            except ValueError as ve:
-                 print(f"ERROR during STL decomposition: {ve}")
-                 return df_result
-            
-            except Exception as e:
-                 print(f"UNEXPECTED ERROR during STL decomposition: {e}")
-                 return df_result
-
-            # Detect anomalies in residuals
-            if len(residuals.dropna()) < 2: return df_result
-            resid_mean = residuals.mean(); resid_std = residuals.std()
-            if resid_std is None or pd.isna(resid_std) or resid_std == 0: return df_result
-            resid_z_scores = (residuals - resid_mean) / resid_std
-            anomaly_mask_stl = resid_z_scores.abs() > threshold
+            AnomalyService._flag_time_series_stl(df, values, threshold, seasonal_period, is_anomaly, anomaly_reason)
 
-            if anomaly_mask_stl.any():
-                anomaly_datetime_indices = residuals[anomaly_mask_stl].index
+        elif anomaly_type == 'hampel':
+            AnomalyService._flag_hampel(df, values, threshold, hampel_window, is_anomaly, anomaly_reason)
 
-                anomalous_ts_rows_mask = df_ts.index.isin(anomaly_datetime_indices)
-                anomalous_ts_rows = df_ts[anomalous_ts_rows_mask]
-
-                if not anomalous_ts_rows.empty:
-                    # Get the ORIGINAL index values stored in our preserved column
-                    original_indices_to_flag = anomalous_ts_rows[original_index_col_name].unique()
+        else:
+            print(f"Warning: Unknown anomaly_type '{anomaly_type}'. No anomalies detected.")
 
-                    # Update the main result DataFrame using these original indices
-                    df_result.loc[original_indices_to_flag, 'is_anomaly'] = True
+        # Shallow copy: the result shares the input's column data and only gets the new columns set on it,
+        # so the caller's frame is left untouched without copying it (df.assign would deep-copy)
+        result = df.copy(deep=False)
+        result['is_anomaly'] = is_anomaly
+        result['anomaly_reason'] = anomaly_reason
+        if coerced:
+            result[value_col] = values
+        return result
 
-                    # Assign reasons: Create a map from datetime index to reason string
-                    relevant_z_scores = resid_z_scores.loc[anomaly_datetime_indices]
-                    reason_map = {dt: f"Time Series STL: Residual Z-score exceeds threshold {threshold}"
-                                  for dt, z in relevant_z_scores.items()}
+    @staticmethod
+    def _flag_statistical(values, threshold, is_anomaly, anomaly_reason):
+        """Flags values whose Z-score exceeds the threshold."""
+        # Fused mean/std/Z-score/mask kernel; fewer than 2 valid values or a std of 0 flags nothing
+        vals = values.to_numpy(dtype=np.float64, na_value=np.nan)
+        z_scores, anomaly_mask = _zscore_mask(vals, float(threshold))
+        is_anomaly[anomaly_mask] = True
+
+        # Build reason strings only for the flagged rows
+        anomaly_reason[anomaly_mask] = [
+            f"Statistical: Z-score {z:.2f} exceeds threshold {threshold}" for z in z_scores[anomaly_mask]
+        ]
 
-                    # Apply reasons: map datetime index of anomalous_ts_rows to get correct reason string for each row
-                    df_result.loc[original_indices_to_flag, 'anomaly_reason'] = anomalous_ts_rows.index.map(reason_map)
+    @staticmethod
+    def _flag_out_of_range(values, min_value, max_value, is_anomaly, anomaly_reason):
+        """Flags values below min_value and/or above max_value."""
+        if min_value is None and max_value is None:
+            # No range defined, cannot detect this type of anomaly
+             print("Warning: Out of Range detection selected but no min or max provided.")
+             return
+
+        # Comparisons run on the float64 array; raw values keep their original formatting for the reasons
+        vals = values.to_numpy(dtype=np.float64, na_value=np.nan)
+        raw_values = values.to_numpy()
+        valid_mask = ~np.isnan(vals)
+
+        if min_value is not None:
+             below_min_mask = valid_mask & (vals < min_value)
+             is_anomaly[below_min_mask] = True
+             anomaly_reason[below_min_mask] = [
+                 f"Out of Range: Value {v} is below minimum {min_value}"
+                 for v in raw_values[below_min_mask]
+             ]
+
+
+        if max_value is not None:
+             above_max_mask = valid_mask & (vals > max_value)
+             is_anomaly[above_max_mask] = True
+             # Add/Update reason for values above max (potential overlap with below_min if min > max)
+             # If already marked below min, append reason; otherwise set reason
+             above_max_reasons = np.array(
+                 [f"Out of Range: Value {v} is above maximum {max_value}" for v in raw_values[above_max_mask]],
+                 dtype=object
+             )
+             previous_reasons = anomaly_reason[above_max_mask]
+             anomaly_reason[above_max_mask] = np.where(
+                 previous_reasons != '', previous_reasons + "; " + above_max_reasons, above_max_reasons
+             )
 
-        else:
-            print(f"Warning: Unknown anomaly_type '{anomaly_type}'. No anomalies detected.")
+    @staticmethod
+    def _flag_hampel(df, values, threshold, hampel_window, is_anomaly, anomaly_reason):
+        """
+        Flags values that deviate from their rolling median by more than threshold scaled MADs.
+        The window runs over one series at a time (rows sharing HAMPEL_SERIES_COLUMNS), in chronological order.
+        """
+        n = len(values)
+        # Sort keys for np.lexsort, last key is primary: date within series, series by their key columns
+        # (factorize with sort=True orders datetime64 natively and ISO 'YYYY-MM-DD' strings chronologically)
+        sort_keys = [pd.factorize(df['date'], sort=True)[0] if 'date' in df.columns else np.arange(n)]
+        series_codes = [pd.factorize(df[col])[0] for col in reversed(HAMPEL_SERIES_COLUMNS) if col in df.columns]
+        order = np.lexsort(sort_keys + series_codes)
+
+        # Series boundaries: positions in sorted order where any series key changes
+        starts = np.zeros(n, dtype=bool)
+        starts[0] = True
+        for codes in series_codes:
+            sorted_codes = codes[order]
+            starts[1:] |= sorted_codes[1:] != sorted_codes[:-1]
+        bounds = np.append(np.flatnonzero(starts), n)
+
+        vals = values.to_numpy(dtype=np.float64, na_value=np.nan)[order]
+        mask = np.zeros(n, dtype=bool)
+        medians = np.full(n, np.nan)
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            mask[start:stop], medians[start:stop] = _hampel_mask(vals[start:stop], int(hampel_window), float(threshold))
+        flagged_positions = order[mask]
+
+        is_anomaly[flagged_positions] = True
+        anomaly_reason[flagged_positions] = [
+            f"Hampel: Value {v} deviates from rolling median {median:.2f} by more than {threshold} MADs"
+            for v, median in zip(values.to_numpy()[flagged_positions], medians[mask])
+        ]
 
-        return df_result
+    @staticmethod
+    def _flag_time_series_stl(df, values, threshold, seasonal_period, is_anomaly, anomaly_reason):
+        """Flags rows whose STL residual Z-score exceeds the threshold."""
+        if 'date' not in df.columns:
+            print("Warning: 'date' column required for time_series_stl not found.")
+            return
+
+        # Only the valid rows are analyzed; their positions map results back onto the full frame
+        valid_positions = np.flatnonzero(values.notna().to_numpy())
+        original_index_col_name = 'original_index'
+        df_ts = pd.DataFrame({
+            'date': df['date'].to_numpy()[valid_positions],
+            'value': values.to_numpy()[valid_positions],
+            original_index_col_name: valid_positions
+        })
+
+        try:
+            df_ts['datetime'] = pd.to_datetime(df_ts['date'], format='%Y-%m-%d', errors='coerce')
+            df_ts.dropna(subset=['datetime'], inplace=True)
+
+            if df_ts.empty:
+                 print("Warning: No valid dates found for STL.")
+                 return
+            
+            # 'datetime' set as working index for STL
+            df_ts = df_ts.set_index('datetime').sort_index()
+        except Exception as e:
+            print(f"Warning: Could not process 'date' column for STL: {e}")
+            return
+
+        if len(df_ts) < 2 * seasonal_period:
+            print(f"Warning: Insufficient data ({len(df_ts)} points) for STL. Need {2 * seasonal_period}.")
+            return
+
+        # STL Decomposition (statsmodels/scipy are imported here so other detection types never load them)
+        from statsmodels.tsa.seasonal import STL
+        try:
+            seasonal_smoother_len = max(7, seasonal_period + 1 if seasonal_period % 2 == 0 else seasonal_period)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                stl = STL(endog=df_ts['value'], period=seasonal_period, seasonal=seasonal_smoother_len, robust=True)
+                result = stl.fit()
+
+            residuals = result.resid # Indexed by datetime
+        except ValueError as ve:
+             print(f"ERROR during STL decomposition: {ve}")
+             return
+        
+        except Exception as e:
+             print(f"UNEXPECTED ERROR during STL decomposition: {e}")
+             return
+
+        # Detect anomalies in residuals
+        resid_z, anomaly_mask_stl = _zscore_mask(residuals.to_numpy(dtype=np.float64), float(threshold))
+        resid_z_scores = pd.Series(resid_z, index=residuals.index)
+
+        if anomaly_mask_stl.any():
+            anomaly_datetime_indices = residuals[anomaly_mask_stl].index
+
+            anomalous_ts_rows_mask = df_ts.index.isin(anomaly_datetime_indices)
+            anomalous_ts_rows = df_ts[anomalous_ts_rows_mask]
+
+            if not anomalous_ts_rows.empty:
+                # Get the ORIGINAL row positions stored in our preserved column
+                original_indices_to_flag = anomalous_ts_rows[original_index_col_name].to_numpy()
+
+                # Update the result arrays using these original positions
+                is_anomaly[original_indices_to_flag] = True
+
+                # Assign reasons: Create a map from datetime index to reason string
+                relevant_z_scores = resid_z_scores.loc[anomaly_datetime_indices]
+                reason_map = {dt: f"Time Series STL: Residual Z-score exceeds threshold {threshold}"
+                              for dt, z in relevant_z_scores.items()}
+
+                # Apply reasons: map datetime index of anomalous_ts_rows to get correct reason string for each row
+                anomaly_reason[original_indices_to_flag] = list(anomalous_ts_rows.index.map(reason_map))
@@ -8,10 +8,55 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 from services.anomaly_service import AnomalyService
 
+def _by_id(result):
+    """Indexes a detection result by 'id' for scalar lookups via .at."""
+    return result.set_index('id')
+
+# Detection cases run against the class's basic_data unless a case brings its own 'data'.
+# 'flagged' lists every id expected to be flagged (NaN rows never are); 'reasons'/'absent' map ids to
+# substrings that must / must not appear in their anomaly_reason.
+_THREE_MONTHS = ['2023-01-01', '2023-02-01', '2023-03-01']
+
+STATISTICAL_CASES = [
+    dict(name='finds_outlier', params=dict(threshold=2.0), flagged=[4],
+         reasons={4: ["Statistical: Z-score"]}),
+    dict(name='no_outliers', data={'id': [1, 2, 3], 'date': _THREE_MONTHS, 'value': [10.0, 10.5, 11.0]},
+         params=dict(threshold=3.0), flagged=[]),
+    dict(name='zero_std_dev', data={'id': [1, 2, 3], 'date': _THREE_MONTHS, 'value': [10.0, 10.0, 10.0]},
+         params=dict(threshold=3.0), flagged=[]),
+    dict(name='insufficient_data', data={'id': [1], 'date': ['2023-01-01'], 'value': [10.0]},
+         params=dict(threshold=3.0), flagged=[]),
+]
+
+OOR_CASES = [
+    dict(name='below_min', params=dict(min_value=9.9), flagged=[5],
+         reasons={5: ["below minimum"]}),
+    dict(name='above_max', params=dict(max_value=50.0), flagged=[4],
+         reasons={4: ["above maximum"]}),
+    # One below min, another above max
+    dict(name='both_min_max',
+         data={'id': [1, 2, 3, 4], 'date': _THREE_MONTHS + ['2023-04-01'], 'value': [5.0, 10.0, 15.0, 25.0]},
+         params=dict(min_value=8.0, max_value=20.0), flagged=[1, 4],
+         reasons={1: ["below minimum 8.0"], 4: ["above maximum 20.0"]},
+         absent={1: ["above maximum"], 4: ["below minimum"]}),
+    # One value below min AND above max (min > max case), both reasons present
+    dict(name='value_violates_both', data={'id': [1], 'date': ['2023-01-01'], 'value': [15.0]},
+         params=dict(min_value=20.0, max_value=10.0), flagged=[1],
+         reasons={1: ["below minimum 20.0", "above maximum 10.0"]}),
+    dict(name='no_anomalies', params=dict(min_value=0.0, max_value=150.0), flagged=[]),
+    dict(name='no_min_max_provided', params=dict(min_value=None, max_value=None), flagged=[]),
+]
+
+# Smooth seasonal series with trend and no outliers; constant inputs, so evaluated once at import (read only)
+_SMOOTH_DATES = pd.date_range(start='2022-01-01', periods=30, freq='MS').strftime('%Y-%m-%d').to_numpy()
+_SMOOTH_VALUES = 15 + 10 * np.sin(np.linspace(0, 4 * np.pi, 30)) + np.linspace(0, 5, 30)
+_SMOOTH_VALUES.setflags(write=False)
+
 class TestAnomalyService(unittest.TestCase):
-    def setUp(self):
-        """Set up reusable test data with 'YYYY-MM-DD' date format."""
-        self.basic_data = pd.DataFrame({
+    @classmethod
+    def setUpClass(cls):
+        """Set up shared test data with 'YYYY-MM-DD' date format once per class (read only; tests copy before mutating)."""
+        cls._basic_data = pd.DataFrame({
             'id': [1, 2, 3, 4, 5, 6, 7],
             'date': ['2023-01-01', '2023-02-01', '2023-03-01', '2023-04-01', '2023-05-01', '2023-06-01', '2023-07-01'],
             'value': [10.0, 11.0, 10.5, 100.0, 9.8, 10.2, np.nan]
@@ -22,28 +67,33 @@ class TestAnomalyService(unittest.TestCase):
         values = [10, 11, 12, 18, 19, 20, 11, 12, 13, 19, 20, 21, # Yr 1
                   10, 11, 12, 18, 19, 500, 11, 12, 13, 19, 20, 21, # Yr 2 (anomaly at id=18)
                   10, 11, 12, 18, 19, 20] # Start of Yr 3
-        self.ts_data = pd.DataFrame({
+        cls._ts_data_str = pd.DataFrame({
             'id': range(1, 31),
             'date': dates,
             'value': values
         })
 
-        # Data with duplicate dates for STL mapping test
-        self.ts_data_duplicates = pd.DataFrame({
-            'id': [101, 102, 103, 104, 105, 106, 107, 108],
+        # Data with duplicate dates for STL mapping test (ids 101-108), appended to filler data
+        # Need enough data points around duplicates for STL (seeded so the filler is deterministic)
+        rng = np.random.default_rng(0)
+        dates_around = pd.date_range(start='2022-01-01', end='2023-12-01', freq='MS').strftime('%Y-%m-%d').to_numpy()
+        # Columns are concatenated directly; the frame is built once, no pd.concat
+        cls._ts_data_duplicates_full = pd.DataFrame({
+            'id': np.concatenate([np.arange(200, 200 + len(dates_around)), np.arange(101, 109)]),
             # Duplicate dates
-            'date': ['2023-01-01', '2023-01-01', '2023-02-01', '2023-03-01', '2023-04-01', '2023-04-01', '2023-05-01', '2023-06-01'],
+            'date': np.concatenate([dates_around, ['2023-01-01', '2023-01-01', '2023-02-01', '2023-03-01', '2023-04-01', '2023-04-01', '2023-05-01', '2023-06-01']]),
             # Make one value anomalous for date group if needed, or rely on STL residual
-            'value': [10, 11, 15, 16, 50, 55, 18, 19]
-        })
-        # Need enough data points around duplicates for STL
-        dates_around = pd.date_range(start='2022-01-01', end='2023-12-01', freq='MS').strftime('%Y-%m-%d')
-        filler_data = pd.DataFrame({
-             'id': range(200, 200 + len(dates_around)),
-             'date': dates_around,
-             'value': np.random.normal(15, 2, len(dates_around))
+            'value': np.concatenate([rng.normal(15, 2, len(dates_around)), [10.0, 11.0, 15.0, 16.0, 50.0, 55.0, 18.0, 19.0]])
         })
-        self.ts_data_duplicates_full = pd.concat([filler_data, self.ts_data_duplicates], ignore_index=True)
+
+        # Smooth seasonal data with trend, no outliers
+        cls._smooth_data = pd.DataFrame({'id': range(1, 31), 'date': _SMOOTH_DATES, 'value': _SMOOTH_VALUES})
+
+        # Dates of the time series fixtures are parsed once here, so STL does not re-parse strings per test.
+        # _ts_data_str keeps the string dates for tests that inject malformed ones
+        cls._ts_data = cls._ts_data_str.assign(date=pd.to_datetime(cls._ts_data_str['date'], format='%Y-%m-%d'))
+        for fixture in (cls._ts_data_duplicates_full, cls._smooth_data):
+            fixture['date'] = pd.to_datetime(fixture['date'], format='%Y-%m-%d')
 
 
     # General Edge Case Tests
@@ -61,105 +111,59 @@ class TestAnomalyService(unittest.TestCase):
         df_all_nan = pd.DataFrame({'id': [1, 2], 'date': ['2023-01-01', '2023-02-01'], 'value': [np.nan, np.nan]})
         result = AnomalyService.detect_anomalies(df_all_nan, 'value')
         self.assertFalse(result['is_anomaly'].any())
-        self.assertTrue(all(r == '' for r in result['anomaly_reason']))
-
-    # Statistical Method Tests
-    def test_statistical_finds_outlier(self):
-        result = AnomalyService.detect_anomalies(self.basic_data.copy(), 'value', anomaly_type='statistical', threshold=2.0)
-        self.assertTrue(result.loc[result['id'] == 4, 'is_anomaly'].iloc[0])
-        self.assertFalse(result.loc[result['id'] == 1, 'is_anomaly'].iloc[0])
-        self.assertIn("Statistical: Z-score", result.loc[result['id'] == 4, 'anomaly_reason'].iloc[0])
-        self.assertFalse(result.loc[result['value'].isna(), 'is_anomaly'].any())
-
-    def test_statistical_no_outliers(self):
-        df_no_outliers = pd.DataFrame({'id': [1,2,3], 'date': ['2023-01-01', '2023-02-01', '2023-03-01'], 'value': [10.0, 10.5, 11.0]})
-        result = AnomalyService.detect_anomalies(df_no_outliers, 'value', anomaly_type='statistical', threshold=3.0)
-        self.assertFalse(result['is_anomaly'].any())
-
-    def test_statistical_zero_std_dev(self):
-        df_zero_std = pd.DataFrame({'id': [1,2,3], 'date': ['2023-01-01', '2023-02-01', '2023-03-01'], 'value': [10.0, 10.0, 10.0]})
-        result = AnomalyService.detect_anomalies(df_zero_std, 'value', anomaly_type='statistical', threshold=3.0)
-        self.assertFalse(result['is_anomaly'].any())
-
-    def test_statistical_insufficient_data(self):
-        df_one_point = pd.DataFrame({'id': [1], 'date': ['2023-01-01'], 'value': [10.0]})
-        result = AnomalyService.detect_anomalies(df_one_point, 'value', anomaly_type='statistical', threshold=3.0)
-        self.assertFalse(result['is_anomaly'].any())
-
-    # Out of Range Method Tests
-    def test_out_of_range_below_min(self):
-        result = AnomalyService.detect_anomalies(self.basic_data.copy(), 'value', anomaly_type='out_of_range', min_value=9.9)
-        self.assertTrue(result.loc[result['id'] == 5, 'is_anomaly'].iloc[0])
-        self.assertFalse(result.loc[result['id'] == 1, 'is_anomaly'].iloc[0])
-        self.assertIn("below minimum", result.loc[result['id'] == 5, 'anomaly_reason'].iloc[0])
-        self.assertFalse(result.loc[result['value'].isna(), 'is_anomaly'].any())
-
-    def test_out_of_range_above_max(self):
-        result = AnomalyService.detect_anomalies(self.basic_data.copy(), 'value', anomaly_type='out_of_range', max_value=50.0)
-        self.assertTrue(result.loc[result['id'] == 4, 'is_anomaly'].iloc[0])
-        self.assertFalse(result.loc[result['id'] == 1, 'is_anomaly'].iloc[0])
-        self.assertIn("above maximum", result.loc[result['id'] == 4, 'anomaly_reason'].iloc[0])
-
-    def test_out_of_range_both_min_max(self):
-        # Test data where one is below min, another above max
-        data_both = pd.DataFrame({
-            'id': [1, 2, 3, 4],
-            'date': ['2023-01-01', '2023-02-01', '2023-03-01', '2023-04-01'],
-            'value': [5.0, 10.0, 15.0, 25.0]
-        })
-        result = AnomalyService.detect_anomalies(data_both.copy(), 'value', anomaly_type='out_of_range', min_value=8.0, max_value=20.0)
-
-        # Check ID=1 (5.0)
-        self.assertTrue(result.loc[result['id'] == 1, 'is_anomaly'].iloc[0])
-        self.assertIn("below minimum 8.0", result.loc[result['id'] == 1, 'anomaly_reason'].iloc[0])
-        self.assertNotIn("above maximum", result.loc[result['id'] == 1, 'anomaly_reason'].iloc[0])
-
-        # Check ID=4 (25.0)
-        self.assertTrue(result.loc[result['id'] == 4, 'is_anomaly'].iloc[0])
-        self.assertIn("above maximum 20.0", result.loc[result['id'] == 4, 'anomaly_reason'].iloc[0])
-        self.assertNotIn("below minimum", result.loc[result['id'] == 4, 'anomaly_reason'].iloc[0])
-
-        # Check IDs 2 & 3 not anomalies
-        self.assertFalse(result.loc[result['id'] == 2, 'is_anomaly'].iloc[0])
-        self.assertFalse(result.loc[result['id'] == 3, 'is_anomaly'].iloc[0])
-
-    def test_out_of_range_value_violates_both(self):
-         # Test data where one value is below min AND above max (min > max case)
-        data_both_violate = pd.DataFrame({'id': [1], 'date': ['2023-01-01'], 'value': [15.0]})
-        result = AnomalyService.detect_anomalies(data_both_violate.copy(), 'value', anomaly_type='out_of_range', min_value=20.0, max_value=10.0)
-        self.assertTrue(result.loc[result['id'] == 1, 'is_anomaly'].iloc[0])
-        reason = result.loc[result['id'] == 1, 'anomaly_reason'].iloc[0]
-
-        # Check if both reasons present
-        self.assertIn("below minimum 20.0", reason)
-        self.assertIn("above maximum 10.0", reason)
-
-    def test_out_of_range_no_anomalies(self):
-        result = AnomalyService.detect_anomalies(self.basic_data.copy(), 'value', anomaly_type='out_of_range', min_value=0.0, max_value=150.0)
-        self.assertFalse(result.loc[result['value'].notna(), 'is_anomaly'].any())
-
-    def test_out_of_range_no_min_max_provided(self):
-        result = AnomalyService.detect_anomalies(self.basic_data.copy(), 'value', anomaly_type='out_of_range', min_value=None, max_value=None)
-        self.assertFalse(result['is_anomaly'].any())
+        self.assertTrue((result['anomaly_reason'].fillna('') == '').all())
+
+    def test_input_dataframe_not_mutated(self):
+        # Tests share the class templates without copying, so the service must leave its input untouched
+        original = self._basic_data.copy()
+        result = AnomalyService.detect_anomalies(self._basic_data, 'value', anomaly_type='statistical', threshold=2.0)
+        pd.testing.assert_frame_equal(self._basic_data, original)
+
+        # Also when the value column has to be coerced to numbers
+        df_str = self._basic_data.assign(value=self._basic_data['value'].astype(str))
+        original_str = df_str.copy()
+        result_str = AnomalyService.detect_anomalies(df_str, 'value', anomaly_type='statistical', threshold=2.0)
+        pd.testing.assert_frame_equal(df_str, original_str)
+        self.assertTrue(pd.api.types.is_numeric_dtype(result_str['value']))
+        self.assertIn('is_anomaly', result.columns)
+        self.assertIn('anomaly_reason', result.columns)
+
+    # Statistical & Out of Range Method Tests (table driven, see STATISTICAL_CASES / OOR_CASES)
+    def _check_cases(self, anomaly_type, cases):
+        for case in cases:
+            with self.subTest(case['name']):
+                df = pd.DataFrame(case['data']) if 'data' in case else self._basic_data
+                result = AnomalyService.detect_anomalies(df, 'value', anomaly_type=anomaly_type, **case['params'])
+                r = _by_id(result)
+                self.assertEqual(sorted(r.index[r['is_anomaly']].tolist()), case['flagged'])
+                for row_id, substrings in case.get('reasons', {}).items():
+                    for substring in substrings:
+                        self.assertIn(substring, r.at[row_id, 'anomaly_reason'])
+                for row_id, substrings in case.get('absent', {}).items():
+                    for substring in substrings:
+                        self.assertNotIn(substring, r.at[row_id, 'anomaly_reason'])
+
+    def test_statistical_matrix(self):
+        self._check_cases('statistical', STATISTICAL_CASES)
+
+    def test_out_of_range_matrix(self):
+        self._check_cases('out_of_range', OOR_CASES)
 
 
     # Time Series STL Method Tests
     def test_time_series_stl_finds_outlier(self):
-        result = AnomalyService.detect_anomalies(self.ts_data.copy(), 'value', anomaly_type='time_series_stl', threshold=3.0, seasonal_period=12)
+        result = AnomalyService.detect_anomalies(self._ts_data, 'value', anomaly_type='time_series_stl', threshold=3.0, seasonal_period=12)
         anomaly_row = result[result['is_anomaly']]
         self.assertEqual(len(anomaly_row), 1, "Should find exactly one anomaly")
         self.assertEqual(anomaly_row['id'].iloc[0], 18)
         self.assertIn("Time Series STL: Residual Z-score", anomaly_row['anomaly_reason'].iloc[0])
 
     def test_time_series_stl_no_outliers(self):
-        smooth_dates = pd.date_range(start='2022-01-01', periods=30, freq='MS').strftime('%Y-%m-%d')
-        smooth_values = 15 + 10 * np.sin(np.linspace(0, 4 * np.pi, 30)) + np.linspace(0, 5, 30)
-        df_smooth = pd.DataFrame({'id': range(1, 31), 'date': smooth_dates, 'value': smooth_values})
-        result = AnomalyService.detect_anomalies(df_smooth, 'value', anomaly_type='time_series_stl', threshold=3.5, seasonal_period=12)
+        result = AnomalyService.detect_anomalies(self._smooth_data, 'value', anomaly_type='time_series_stl', threshold=3.5, seasonal_period=12)
         self.assertFalse(result['is_anomaly'].any(), "Smooth data failed with threshold 3.5")
 
     def test_time_series_stl_insufficient_data(self):
-        short_ts = self.ts_data.head(20).copy()
+        short_ts = self._ts_data.head(20)
         result = AnomalyService.detect_anomalies(short_ts, 'value', anomaly_type='time_series_stl', threshold=3.0, seasonal_period=12)
         self.assertFalse(result['is_anomaly'].any())
 
@@ -169,25 +173,26 @@ class TestAnomalyService(unittest.TestCase):
         self.assertFalse(result['is_anomaly'].any())
 
     def test_time_series_stl_bad_date_format_in_data(self):
-        df_bad_date = self.ts_data.copy()
+        df_bad_date = self._ts_data_str.copy()
         df_bad_date.loc[5, 'date'] = 'not-a-date' # Original index 5 -> id 6
         df_bad_date.loc[15, 'date'] = 'Jan 2023' # Original index 15 -> id 16
 
         result = AnomalyService.detect_anomalies(df_bad_date, 'value', anomaly_type='time_series_stl', threshold=3.0) # Use default period 12
+        r = _by_id(result)
 
-        self.assertFalse(result.loc[result['id'] == 6, 'is_anomaly'].any(), "Row with 'not-a-date' should not be flagged")
-        self.assertFalse(result.loc[result['id'] == 16, 'is_anomaly'].any(), "Row with 'Jan 2023' should not be flagged")
+        self.assertFalse(r.at[6, 'is_anomaly'], "Row with 'not-a-date' should not be flagged")
+        self.assertFalse(r.at[16, 'is_anomaly'], "Row with 'Jan 2023' should not be flagged")
 
     def test_time_series_stl_duplicate_dates(self):
-         # Uses self.ts_data_duplicates_full with clear outlier (500) for id=105
-         result = AnomalyService.detect_anomalies(self.ts_data_duplicates_full.copy(), 'value', anomaly_type='time_series_stl', threshold=3.0, seasonal_period=12) # Use threshold 3.0
+         # Uses self._ts_data_duplicates_full with clear outlier (500) for id=105
+         result = AnomalyService.detect_anomalies(self._ts_data_duplicates_full, 'value', anomaly_type='time_series_stl', threshold=3.0, seasonal_period=12) # Use threshold 3.0
 
          anomalies = result[result['is_anomaly']]
          flagged_ids = anomalies['id'].tolist()
 
          self.assertIn(105, flagged_ids, "ID 105 (value 500 on 2023-04-01) should be flagged")
 
-         reason105 = anomalies.loc[anomalies['id'] == 105, 'anomaly_reason'].iloc[0]
+         reason105 = _by_id(anomalies).at[105, 'anomaly_reason']
          self.assertTrue(reason105.startswith("Time Series STL: Residual Z-score"))
 
          # Check that rows on non-anomalous dates not flagged
@@ -198,6 +203,54 @@ class TestAnomalyService(unittest.TestCase):
          self.assertNotIn(200, flagged_ids)
          self.assertNotIn(210, flagged_ids)
 
+    # Hampel Method Tests
+    def _hampel_data(self):
+        # Small repeating pattern (100, 101, 102) with a spike at id=15
+        values = [100.0 + (i % 3) for i in range(30)]
+        values[14] = 500.0
+        dates = pd.date_range(start='2022-01-01', periods=30, freq='MS').strftime('%Y-%m-%d')
+        return pd.DataFrame({'id': range(1, 31), 'date': dates, 'value': values})
+
+    def test_hampel_finds_outlier(self):
+        result = AnomalyService.detect_anomalies(self._hampel_data(), 'value', anomaly_type='hampel', threshold=3.0, hampel_window=3)
+        anomaly_row = result[result['is_anomaly']]
+        self.assertEqual(anomaly_row['id'].tolist(), [15])
+        self.assertIn("Hampel: Value 500.0", anomaly_row['anomaly_reason'].iloc[0])
+
+    def test_hampel_uses_chronological_order(self):
+        shuffled = self._hampel_data().sample(frac=1, random_state=0)
+        result = AnomalyService.detect_anomalies(shuffled, 'value', anomaly_type='hampel', threshold=3.0, hampel_window=3)
+        self.assertEqual(result.loc[result['is_anomaly'], 'id'].tolist(), [15])
+
+    def test_hampel_datetime_dates(self):
+        shuffled = self._hampel_data().sample(frac=1, random_state=0)
+        shuffled['date'] = pd.to_datetime(shuffled['date'], format='%Y-%m-%d')
+        result = AnomalyService.detect_anomalies(shuffled, 'value', anomaly_type='hampel', threshold=3.0, hampel_window=3)
+        self.assertEqual(result.loc[result['is_anomaly'], 'id'].tolist(), [15])
+
+    def test_hampel_windows_per_series(self):
+        # Two ports on the same dates at very different levels; interleaved by date they would flag each other
+        low = self._hampel_data().assign(port_code=101, measure='Trucks')
+        high = self._hampel_data().assign(id=lambda d: d['id'] + 100, value=lambda d: d['value'] * 50, port_code=102, measure='Trucks')
+        high.loc[high['id'] == 115, 'value'] = 5050.0 # Undo the spike, only the low series has one
+        df_two_series = pd.concat([low, high], ignore_index=True).sort_values(['date', 'port_code'], kind='stable')
+        result = AnomalyService.detect_anomalies(df_two_series, 'value', anomaly_type='hampel', threshold=3.0, hampel_window=3)
+        self.assertEqual(result.loc[result['is_anomaly'], 'id'].tolist(), [15])
+
+    def test_hampel_zero_mad_not_flagged(self):
+        # Constant windows have a MAD of 0, so a small deviation must not count as infinitely many MADs
+        values = [0.0] * 30
+        values[14] = 1.0
+        df_constant = self._hampel_data().assign(value=values)
+        result = AnomalyService.detect_anomalies(df_constant, 'value', anomaly_type='hampel', threshold=1000.0, hampel_window=3)
+        self.assertFalse(result['is_anomaly'].any())
+
+    def test_hampel_ignores_nan(self):
+        result = AnomalyService.detect_anomalies(self._basic_data, 'value', anomaly_type='hampel', threshold=3.0, hampel_window=3)
+        r = _by_id(result)
+        self.assertTrue(r.at[4, 'is_anomaly'])
+        self.assertFalse(r.loc[r['value'].isna(), 'is_anomaly'].any())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+import sqlite3
+import pandas as pd
+import numpy as np
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from api.data_routes import statistical_anomalies, where_clause, DATA_COLUMNS
+from services.anomaly_service import AnomalyService
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), '..', 'schema.sql')
+
+class TestStatisticalAnomaliesSQL(unittest.TestCase):
+    """The /anomalies 'statistical' path runs in SQLite; these tests keep it in line with AnomalyService."""
+
+    def setUp(self):
+        """In-memory database with the real schema."""
+        self.db = sqlite3.connect(':memory:')
+        with open(SCHEMA_PATH) as f:
+            self.db.executescript(f.read())
+        self.cursor = self.db.cursor()
+
+    def tearDown(self):
+        self.db.close()
+
+    def _insert(self, values, state='Maine'):
+        self.db.executemany(
+            "INSERT INTO border_crossing_entry_data (port_name, state, port_code, border, date, measure, value) "
+            "VALUES ('Jackman', ?, 104, 'US-Canada Border', ?, 'Trucks', ?)",
+            [(state, f'2023-{month:02d}-01', value) for month, value in enumerate(values, start=1)]
+        )
+
+    def _run(self, threshold, **filters):
+        """Runs the SQL detection the way get_anomalies does (filters + 'value IS NOT NULL')."""
+        where = where_clause(tuple(filters)) + ' AND value IS NOT NULL'
+        return statistical_anomalies(self.cursor, where, filters, threshold)
+
+    def _run_service(self, threshold):
+        """Runs AnomalyService on the same table and returns its anomalous records."""
+        df = pd.read_sql_query(f"SELECT {', '.join(DATA_COLUMNS)} FROM border_crossing_entry_data", self.db)
+        result = AnomalyService.detect_anomalies(df, 'value', anomaly_type='statistical', threshold=threshold)
+        return result[result['is_anomaly']].to_dict(orient='records')
+
+    def test_matches_service(self):
+        self._insert([10, 11, 10, 100, 9, 10, 12, 11])
+        for threshold in (1.0, 2.0, 3.0):
+            with self.subTest(threshold=threshold):
+                anomalies = self._run(threshold)
+                expected = self._run_service(threshold)
+                self.assertEqual([a['id'] for a in anomalies], [e['id'] for e in expected])
+                self.assertEqual([a['anomaly_reason'] for a in anomalies], [e['anomaly_reason'] for e in expected])
+
+    def test_record_shape(self):
+        self._insert([10, 11, 10, 100, 9, 10])
+        anomalies = self._run(2.0)
+        self.assertEqual(len(anomalies), 1)
+        self.assertEqual(list(anomalies[0]), list(DATA_COLUMNS) + ['is_anomaly', 'anomaly_reason'])
+        self.assertTrue(anomalies[0]['is_anomaly'])
+        self.assertEqual(anomalies[0]['value'], 100)
+
+    def test_sample_std_dev(self):
+        # With 5 points the sample (ddof=1) and population std differ enough to change the reported Z-score
+        values = [1, 2, 3, 4, 100]
+        self._insert(values)
+        anomalies = self._run(1.5)
+        z = (100 - np.mean(values)) / np.std(values, ddof=1)
+        self.assertEqual([a['value'] for a in anomalies], [100])
+        self.assertEqual(anomalies[0]['anomaly_reason'], f"Statistical: Z-score {z:.2f} exceeds threshold 1.5")
+
+    def test_insufficient_data(self):
+        self._insert([10])
+        self.assertEqual(self._run(0.1), [])
+
+    def test_no_rows(self):
+        self.assertEqual(self._run(0.1), [])
+
+    def test_zero_std_dev(self):
+        self._insert([10, 10, 10])
+        self.assertEqual(self._run(0.1), [])
+
+    def test_filters_limit_statistics(self):
+        # Texas rows would dominate the mean if the filter were not applied to the aggregates
+        self._insert([10, 11, 10, 100, 9, 10])
+        self._insert([5000, 5000, 5000], state='Texas')
+        anomalies = self._run(2.0, state='Maine')
+        self.assertEqual([(a['state'], a['value']) for a in anomalies], [('Maine', 100)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,9 +10,9 @@ const apiClient = axios.create({
   },
 });
 
-// Function to fetch data with filters
+// Function to fetch data with filters (sorted by date desc, then state and port name)
 export const fetchData = (params) => {
-  return apiClient.get('/data', { params });
+  return apiClient.get('/data', { params: { ...params, sort: 'date_state_port' } });
 };
 
 // Function to fetch anomalies with filters
@@ -165,10 +165,11 @@ function FilterControls({ onFiltersChange, initialFilters }) {
                 </>
              )}
 
-             {(filters.anomaly_type === 'statistical' || filters.anomaly_type === 'time_series_stl') && (
+             {(filters.anomaly_type === 'statistical' || filters.anomaly_type === 'time_series_stl' || filters.anomaly_type === 'hampel') && (
                 <div>
                     <label htmlFor="threshold">
-                        {filters.anomaly_type === 'statistical' ? 'Threshold (Std Dev):' : 'Residual Threshold (Std Dev):'}
+                        {filters.anomaly_type === 'statistical' ? 'Threshold (Std Dev):' :
+                         filters.anomaly_type === 'hampel' ? 'Threshold (Scaled MADs):' : 'Residual Threshold (Std Dev):'}
                     </label><br />
                     <input
                         type="number"
@@ -181,6 +182,8 @@ function FilterControls({ onFiltersChange, initialFilters }) {
                         style={{ width: '80px' }}
                         title={filters.anomaly_type === 'statistical' ? 
                             "Z-score threshold for Statistical detection" : 
+                            filters.anomaly_type === 'hampel' ?
+                            "Allowed deviation from the rolling median, in scaled MADs" :
                             "Z-score threshold applied to STL residuals"}
                     />
                 </div>